@@ -10,16 +10,17 @@ else:
     from . import dependency_graph
 
 
-def compute_stats(path='.', lean_path=None):
+def compute_stats(path='.', lean_path=None, use_cache=True):
     """Return statistics about the Stacks Project dependency graph."""
-    results, edges = dependency_graph.build_graph(path)
+    results, adj = dependency_graph.build_graph(path, use_cache=use_cache)
     stats = {
         'num_nodes': len(results),
-        'num_edges': len(edges),
+        'num_edges': sum(len(dsts) for dsts in adj.values()),
     }
     if lean_path:
-        tag_map = dependency_graph.load_tag_map(path)
-        lean_snippets = dependency_graph.scan_mathlib(lean_path, tag_map)
+        _, lean_snippets = dependency_graph.load_lean_snippets(
+            path, lean_path, use_cache=use_cache
+        )
         stats['num_lean_snippets'] = len(lean_snippets)
         count = sum(1 for label in results if label in lean_snippets)
         stats['num_nodes_with_lean_snippet'] = count
@@ -31,9 +32,10 @@ def main():
     parser.add_argument('path', nargs='?', default='.', help='Path to Stacks Project root')
     parser.add_argument('--lean-path', help='Path to mathlib4 checkout')
     parser.add_argument('--json', action='store_true', help='Output JSON')
+    parser.add_argument('--no-cache', action='store_true', help='Ignore and do not write the on-disk caches')
     args = parser.parse_args()
 
-    stats = compute_stats(args.path, args.lean_path)
+    stats = compute_stats(args.path, args.lean_path, use_cache=not args.no_cache)
 
     if args.json:
         print(json.dumps(stats, indent=2))
@@ -1,6 +1,13 @@
+import bisect
 import os
 import re
 import json
+import mmap
+import pickle
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 # List of environments we consider
 ENVIRONMENTS = [
@@ -8,9 +15,81 @@ ENVIRONMENTS = [
     'remark', 'remarks', 'example', 'exercise',
     'situation', 'equation'
 ]
+# Environment names that may prefix a tracked label (``lemma-foo``)
+ENV_SET = frozenset(ENVIRONMENTS)
 
-# Prefixes used for labels we track
-PREFIXES = tuple(env + '-' for env in ENVIRONMENTS)
+# Patterns used while scanning TeX files, compiled once at import time
+_ENV_ALT = '|'.join(ENVIRONMENTS)
+BEGIN_RE = re.compile(r'\\begin\{(' + _ENV_ALT + r')\}')
+LABEL_RE = re.compile(r'\\label\{([^}]+)\}')
+END_RES = {env: re.compile(r'\\end\{' + env + r'\}') for env in ENVIRONMENTS}
+
+# All tokens relevant to ``parse_file`` in one pass over the raw file bytes
+TOKEN_RE = re.compile(
+    rb'\\begin\{(?P<begin>' + _ENV_ALT.encode() + rb')\}'
+    rb'|\\label\{(?P<label>[^}]+)\}'
+    rb'|\\ref\{(?P<ref>[^}]+)\}'
+    rb'|\\end\{(?P<end>' + _ENV_ALT.encode() + rb')\}'
+)
+_ENV_NAMES = {env.encode(): env for env in ENVIRONMENTS}
+
+# The LIJST variable of the Makefile, including backslash continuations
+LIJST_RE = re.compile(r'^LIJST[ \t]*=[ \t]*((?:.*\\\n)*.*)$', re.MULTILINE)
+
+# Ways mathlib refers to a Stacks tag (canonical URL, ``@[stacks XXXX]``
+# attribute or "Stacks Tag XXXX" in a docstring), in the order they are tried
+# on a line, and the declarations we attach them to. They run over decoded
+# text whose only line separator is ``\n``, so ``[^\S\n]`` is ``\s`` within
+# a line.
+LEAN_TAG_RES = (
+    re.compile(r'https://stacks\.math\.columbia\.edu/tag/([0-9A-Za-z]+)'),
+    re.compile(r'@\[[^\S\n]*stacks[^\S\n]+([0-9A-Za-z]{4})[^\S\n]*\]'),
+    re.compile(r'(?i:Stacks[^\S\n]+Tag[^\S\n]+([0-9A-Za-z]{4}))'),
+)
+# Any of the above, used to find the lines worth looking at
+LEAN_TAG_RE = re.compile('|'.join('(?:%s)' % r.pattern for r in LEAN_TAG_RES))
+LEAN_DECL_RE = re.compile(
+    r'^(lemma|theorem|def|definition|structure|class|instance)[^\S\n]+([\w\.]+)',
+    re.MULTILINE,
+)
+# Every tag form contains "stacks" up to case; under Unicode case folding "s"
+# and "k" also match U+017F and U+212A. Files without it are never decoded.
+LEAN_HINT_RE = re.compile(rb'(?i)(?:s|\xc5\xbf)tac(?:k|\xe2\x84\xaa)(?:s|\xc5\xbf)')
+# Line breaks other than ``\n`` that ``str.splitlines`` honours
+LEAN_LINE_BREAK_RE = re.compile('\r\n|[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+# Name of the on-disk cache written by ``build_graph`` in the project root
+GRAPH_CACHE = '.deps_cache.pkl'
+# Bumped whenever the layout of the cached graph changes
+GRAPH_CACHE_VERSION = 2
+
+# On-disk cache written by ``load_lean_snippets``
+LEAN_CACHE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'stacks-lean.pkl',
+)
+# Bumped whenever ``scan_mathlib`` changes what it returns
+LEAN_CACHE_VERSION = 1
+
+
+def _read_bytes(filename):
+    """Return the contents of ``filename``.
+
+    Uses a raw file descriptor sized by ``fstat`` instead of a buffered
+    file object, which saves a handful of syscalls per file."""
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        chunks = [os.read(fd, os.fstat(fd).st_size + 1)]
+        while chunks[-1]:
+            chunks.append(os.read(fd, 1 << 16))
+    finally:
+        os.close(fd)
+    return b''.join(chunks)
+
+
+def _read_text(filename):
+    """Return the UTF-8 decoded contents of ``filename``."""
+    return _read_bytes(filename).decode('utf-8')
 
 
 def load_tag_map(path):
@@ -19,185 +98,346 @@ def load_tag_map(path):
     tag_map = {}
     if not os.path.exists(tag_file):
         return tag_map
-    with open(tag_file) as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            parts = line.split(',')
-            if len(parts) == 2:
-                tag = parts[0].upper()
-                tag_map[tag] = parts[1]
+    for line in _read_text(tag_file).splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split(',')
+        if len(parts) == 2:
+            tag = parts[0].upper()
+            tag_map[tag] = sys.intern(parts[1])
     return tag_map
 
 
+def _iter_lean_files(path):
+    """Yield the ``.lean`` files below ``path`` in ``os.walk`` order.
+
+    Uses ``os.scandir`` directly so directories are told apart from files
+    without an extra ``stat`` per entry."""
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return
+    dirs = []
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            dirs.append(entry.path)
+        elif entry.name.endswith('.lean'):
+            yield entry.path
+    for subdir in dirs:
+        yield from _iter_lean_files(subdir)
+
+
+def _scan_lean_text(text, tag_map, results):
+    """Add the snippets for the Stacks tags found in ``text`` to ``results``."""
+    if LEAN_LINE_BREAK_RE.search(text):
+        text = LEAN_LINE_BREAK_RE.sub('\n', text)
+    headers = None
+    pos = 0
+    while True:
+        match = LEAN_TAG_RE.search(text, pos)
+        if not match:
+            break
+        line_start = text.rfind('\n', 0, match.start()) + 1
+        line_end = text.find('\n', match.end())
+        if line_end == -1:
+            line_end = len(text)
+        pos = line_end + 1
+        # at most one tag per line, the URL form first
+        line = text[line_start:line_end]
+        for tag_re in LEAN_TAG_RES:
+            tag_match = tag_re.search(line)
+            if tag_match:
+                break
+        label = tag_map.get(tag_match.group(1).upper())
+        if not label or label in results:
+            # the first snippet found for a label wins
+            continue
+        label = sys.intern(label)
+        # nearest lemma/def line at or before the tag, else the first one after
+        if headers is None:
+            headers = [m.start() for m in LEAN_DECL_RE.finditer(text)]
+        idx = bisect.bisect_right(headers, line_start) - 1
+        if idx < 0:
+            idx = bisect.bisect_left(headers, line_start)
+            if idx == len(headers):
+                continue
+        start = headers[idx]
+        # the snippet runs up to two lines past the tag
+        end = line_start
+        for _ in range(3):
+            newline = text.find('\n', end)
+            if newline == -1:
+                end = len(text)
+                break
+            end = newline + 1
+        snippet_lines = text[start:end].splitlines()
+        results[label] = "\n".join(snippet_lines) + "\n"
+
+
 def scan_mathlib(path, tag_map):
     """Return mapping from Stacks labels to Lean code snippets.
 
     Besides the canonical URL form ``https://stacks.math.columbia.edu/tag/XXXX``
     we also recognise ``@[stacks XXXX]`` attributes and "Stacks Tag XXXX" in
     docstrings as used in mathlib. This increases the number of matches.
+    Each file is memory-mapped and only decoded when it mentions "stacks".
     """
     results = {}
-    tag_url_re = re.compile(r'https://stacks\.math\.columbia\.edu/tag/([0-9A-Za-z]+)')
-    attr_tag_re = re.compile(r'@\[\s*stacks\s+([0-9A-Za-z]{4})\s*\]')
-    doc_tag_re = re.compile(r'Stacks\s+Tag\s+([0-9A-Za-z]{4})', re.IGNORECASE)
-    env_re = re.compile(
-        r'^(lemma|theorem|def|definition|structure|class|instance)\s+([\w\.]+)'
-    )
-    for root, _, files in os.walk(path):
-        for name in files:
-            if not name.endswith('.lean'):
-                continue
-            filename = os.path.join(root, name)
-            try:
-                with open(filename, 'r', encoding='utf-8', errors='ignore') as f:
-                    lines = f.read().splitlines()
-            except Exception:
-                continue
-            for i, line in enumerate(lines):
-                match = (
-                    tag_url_re.search(line)
-                    or attr_tag_re.search(line)
-                    or doc_tag_re.search(line)
-                )
-                if not match:
+    for filename in _iter_lean_files(path):
+        try:
+            with open(filename, 'rb') as f:
+                if not os.fstat(f.fileno()).st_size:
                     continue
-                tag = match.group(1).upper()
-                label = tag_map.get(tag)
-                if not label:
-                    continue
-                # search around for lemma/def line
-                j = i
-                while j >= 0 and not env_re.search(lines[j]):
-                    j -= 1
-                if j < 0:
-                    j = i
-                    while j < len(lines) and not env_re.search(lines[j]):
-                        j += 1
-                    if j == len(lines):
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if not LEAN_HINT_RE.search(mm):
                         continue
-                start = j
-                snippet_lines = lines[start : min(len(lines), i + 3)]
-                snippet = "\n".join(snippet_lines) + "\n"
-                results.setdefault(label, snippet)
+                    text = mm[:].decode('utf-8', errors='ignore')
+        except (OSError, ValueError):
+            continue
+        _scan_lean_text(text, tag_map, results)
     return results
 
 
+def _lean_cache_key(path, lean_path):
+    """Return a fingerprint of the tags file and the ``.lean`` files.
+
+    The newest ``.lean`` mtime together with the number of files notices
+    edits, additions and removals anywhere below ``lean_path``."""
+    try:
+        st = os.stat(os.path.join(path, 'tags', 'tags'))
+    except FileNotFoundError:
+        tags = None
+    else:
+        tags = (st.st_size, st.st_mtime_ns)
+    newest = 0
+    count = 0
+    for filename in _iter_lean_files(lean_path):
+        try:
+            mtime = os.stat(filename).st_mtime_ns
+        except FileNotFoundError:
+            # removed while we were walking
+            continue
+        count += 1
+        if mtime > newest:
+            newest = mtime
+    return (
+        LEAN_CACHE_VERSION,
+        os.path.abspath(path),
+        os.path.abspath(lean_path),
+        tags,
+        newest,
+        count,
+    )
+
+
+def load_lean_snippets(path, lean_path, use_cache=True):
+    """Return ``(tag_map, lean_snippets)`` for ``path`` and mathlib at ``lean_path``.
+
+    Unless ``use_cache`` is false the result is cached in ``LEAN_CACHE``
+    and reused while the tags file and the ``.lean`` files are unchanged."""
+    if use_cache:
+        key = _lean_cache_key(path, lean_path)
+        cached = _load_cache(LEAN_CACHE, key)
+        if cached is not None:
+            return cached
+    tag_map = load_tag_map(path)
+    lean_snippets = scan_mathlib(lean_path, tag_map)
+    if use_cache:
+        _store_cache(LEAN_CACHE, key, (tag_map, lean_snippets))
+    return tag_map, lean_snippets
+
+
 def list_text_files(path):
     """Return stems of TeX files listed in the Makefile."""
-    with open(os.path.join(path, 'Makefile'), 'r') as f:
-        for line in f:
-            if line.startswith('LIJST = '):
-                break
-        items = ''
-        while line.rstrip().endswith('\\'):
-            items += ' ' + line.rstrip().rstrip('\\')
-            line = f.readline()
-        items += ' ' + line
-        items = items.replace('LIJST = ', '')
-        return items.split()
-
-
-def parse_file(path, name, results, edges):
-    filename = os.path.join(path, name + '.tex')
-    if not os.path.exists(filename):
-        return
+    data = _read_text(os.path.join(path, 'Makefile'))
+    m = LIJST_RE.search(data)
+    if not m:
+        return []
+    return m.group(1).replace('\\\n', ' ').split()
+
+
+def parse_file(path, name):
+    """Return ``(results, adj)`` for the labelled environments in ``name``.
+
+    ``adj`` maps the label of an environment to the labels it references."""
+    results = {}
+    adj = {}
+    try:
+        data = _read_bytes(os.path.join(path, name + '.tex'))
+    except FileNotFoundError:
+        return results, adj
     env_type = None
     full_label = None
     prefix = name + '-'
-    with open(filename, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if env_type is None:
-                m = re.match(r'\\begin{(' + '|'.join(ENVIRONMENTS) + ')}', line)
-                if m:
-                    env_type = m.group(1)
-                    full_label = None
-                continue
-            else:
-                if full_label is None:
-                    m = re.match(r'\\label{([^}]+)}', line)
-                    if m:
-                        raw_label = m.group(1)
-                        full_label = raw_label if raw_label.startswith(prefix) else prefix + raw_label
-                        results[full_label] = {
-                            'type': env_type,
-                            'file': name,
-                            'label': raw_label,
-                        }
-                        continue
-                for ref in re.findall(r'\\ref{([^}]+)}', line):
-                    target = ref if '-' in ref else prefix + ref
-                    if '-' in target:
-                        check = target.split('-', 1)[1]
-                    else:
-                        check = target
-                    if check.startswith(PREFIXES) and full_label:
-                        edges.append((full_label, target))
-                if re.match(r'\\end{' + env_type + '}', line):
-                    env_type = None
-                    full_label = None
-
-
-def build_graph(path):
+    for m in TOKEN_RE.finditer(data):
+        kind = m.lastgroup
+        if env_type is None:
+            if kind == 'begin':
+                env_type = m.group('begin')
+                full_label = None
+        elif kind == 'end':
+            if m.group('end') == env_type:
+                env_type = None
+                full_label = None
+        elif kind == 'label':
+            if full_label is None:
+                raw_label = m.group('label').decode('utf-8')
+                full_label = raw_label if raw_label.startswith(prefix) else prefix + raw_label
+                full_label = sys.intern(full_label)
+                results[full_label] = {
+                    'type': _ENV_NAMES[env_type],
+                    'file': name,
+                    'label': raw_label,
+                }
+        elif kind == 'ref' and full_label:
+            ref = m.group('ref').decode('utf-8')
+            target = sys.intern(ref if '-' in ref else prefix + ref)
+            # Strip the file part and look up the environment part of the label
+            env, sep, _ = target.partition('-')[2].partition('-')
+            if sep and env in ENV_SET:
+                adj.setdefault(full_label, []).append(target)
+    return results, adj
+
+
+def _graph_cache_key(path, names):
+    """Return a cheap fingerprint of the Makefile and the TeX files in ``names``."""
+    mtimes = [os.stat(os.path.join(path, 'Makefile')).st_mtime_ns]
+    for name in names:
+        try:
+            mtimes.append(os.stat(os.path.join(path, name + '.tex')).st_mtime_ns)
+        except FileNotFoundError:
+            continue
+    return GRAPH_CACHE_VERSION, len(mtimes), max(mtimes)
+
+
+def _load_cache(cache_file, key):
+    """Return the value pickled in ``cache_file`` under ``key`` or ``None``."""
+    try:
+        with open(cache_file, 'rb') as f:
+            cached_key, value = pickle.load(f)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+    return value if cached_key == key else None
+
+
+def _store_cache(cache_file, key, value):
+    """Atomically pickle ``value`` under ``key`` to ``cache_file``.
+
+    Failures (e.g. a read-only checkout) are silently ignored."""
+    cache_dir = os.path.dirname(cache_file) or '.'
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir)
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+def build_graph(path, use_cache=True):
+    """Return ``(results, adj)`` for the TeX files listed in the Makefile.
+
+    Unless ``use_cache`` is false the result is cached in ``GRAPH_CACHE``
+    and reused as long as no TeX file (or the Makefile) has been touched."""
+    names = list_text_files(path)
+    cache_file = os.path.join(path, GRAPH_CACHE)
+    if use_cache:
+        key = _graph_cache_key(path, names)
+        cached = _load_cache(cache_file, key)
+        if cached is not None:
+            return cached
     results = {}
-    edges = []
-    for name in list_text_files(path):
-        parse_file(path, name, results, edges)
-    return results, edges
+    adj = {}
+    # Files are independent, so parse them in worker processes
+    with ProcessPoolExecutor() as pool:
+        for local_results, local_adj in pool.map(partial(parse_file, path), names, chunksize=8):
+            # Labels unpickled from the workers are fresh copies; intern them
+            # again so that results and adj share a single string per label
+            for label, info in local_results.items():
+                results[sys.intern(label)] = info
+            for src, dsts in local_adj.items():
+                adj[sys.intern(src)] = [sys.intern(dst) for dst in dsts]
+    if use_cache:
+        _store_cache(cache_file, key, (results, adj))
+    return results, adj
 
 
-def write_dot(results, edges, outfile):
-    with open(outfile, 'w') as f:
-        f.write('digraph StacksProject {\n')
-        f.write('  node [shape=box];\n')
-        for label, data in results.items():
-            node_label = f"{label}\n({data['file']})"
-            f.write(f'  "{label}" [label="{node_label}"];\n')
-        for src, dst in edges:
+def iter_edges(adj):
+    """Yield the ``(src, dst)`` pairs of the adjacency dict ``adj``."""
+    for src, dsts in adj.items():
+        for dst in dsts:
+            yield src, dst
+
+
+def dot_lines(results, adj):
+    """Yield the lines of the DOT description of the graph."""
+    yield 'digraph StacksProject {\n'
+    yield '  node [shape=box];\n'
+    for label, data in results.items():
+        yield f'  "{label}" [label="{label}\n({data["file"]})"];\n'
+    for src, dsts in adj.items():
+        for dst in dsts:
             if dst in results:
-                f.write(f'  "{src}" -> "{dst}";\n')
-        f.write('}\n')
+                yield f'  "{src}" -> "{dst}";\n'
+    yield '}\n'
 
 
-def _extract_environment(path, label, results):
-    """Return lines of the environment containing ``label``."""
-    info = results.get(label)
-    if not info:
-        return []
-    filename = os.path.join(path, info['file'] + '.tex')
-    target = info.get('label', label)
-    lines = []
-    collecting = False
+def write_dot(results, adj, outfile):
+    # A large buffer keeps the number of write syscalls low while the
+    # lines are streamed from the generator.
+    with open(outfile, 'w', buffering=1 << 20) as f:
+        f.writelines(dot_lines(results, adj))
+
+
+def _extract_environments(path, name, labels):
+    """Return a mapping from ``labels`` to the lines of their environments.
+
+    Scans ``name``.tex once, however many labels are requested; ``labels``
+    are the raw labels as written in the file."""
+    wanted = set(labels)
+    found = {}
     env_type = None
-    with open(filename, 'r') as f:
-        for line in f:
-            if not collecting:
-                if env_type is None:
-                    m = re.match(r'\\begin{(' + '|'.join(ENVIRONMENTS) + ')}', line)
-                    if m:
-                        env_type = m.group(1)
-                        lines = [line]
-                    continue
-                else:
-                    lines.append(line)
-                    if re.search(r'\\label{' + re.escape(target) + '}', line):
-                        collecting = True
-                    if re.match(r'\\end{' + env_type + '}', line):
-                        env_type = None
-                        lines = []
-            else:
-                lines.append(line)
-                if re.match(r'\\end{' + env_type + '}', line):
-                    break
-    return lines
+    lines = []
+    hits = []
+    for line in _read_text(os.path.join(path, name + '.tex')).splitlines(keepends=True):
+        if env_type is None:
+            m = BEGIN_RE.match(line)
+            if not m:
+                continue
+            env_type = m.group(1)
+            lines = [line]
+            hits = []
+        else:
+            lines.append(line)
+            if END_RES[env_type].match(line):
+                env_type = None
+        if '\\label{' in line:
+            hits.extend(lbl for lbl in LABEL_RE.findall(line) if lbl in wanted)
+        if env_type is None:
+            for lbl in hits:
+                found.setdefault(lbl, lines)
+            if len(found) == len(wanted):
+                break
+    else:
+        # Unterminated environment at the end of the file
+        for lbl in hits:
+            found.setdefault(lbl, lines)
+    return found
 
 
 def generate_dependency_tex(
     label,
     results,
-    edges,
+    adj,
     path,
     outfile,
     lean_snippets=None,
@@ -209,31 +449,41 @@ def generate_dependency_tex(
     ``interleave`` is ``True`` and a Lean snippet exists for a lemma or
     definition, then the LaTeX environment and the Lean code are displayed
     side-by-side using ``minipage`` blocks."""
-    adj = {}
-    for src, dst in edges:
-        adj.setdefault(src, []).append(dst)
-
+    # Post-order DFS with an explicit stack; dependency chains in the
+    # Stacks Project are deeper than Python's recursion limit.
     order = []
     visited = set()
-
-    def visit(node):
+    stack = [(label, False)]
+    while stack:
+        node, processed = stack.pop()
+        if processed:
+            order.append(node)
+            continue
         if node in visited or node not in results:
-            return
+            continue
         visited.add(node)
-        for dep in adj.get(node, []):
-            visit(dep)
-        order.append(node)
+        stack.append((node, True))
+        stack.extend((dep, False) for dep in reversed(adj.get(node, ())))
 
-    visit(label)
+    # Extract the environments file by file so that each file is read once
+    by_file = {}
+    for lbl in order:
+        info = results[lbl]
+        by_file.setdefault(info['file'], []).append(info.get('label', lbl))
+    envs = {
+        name: _extract_environments(path, name, labels)
+        for name, labels in by_file.items()
+    }
 
     lean_snippets = lean_snippets or {}
     with open(outfile, 'w') as f:
         f.write('\\documentclass{article}\n')
         f.write('\\begin{document}\n')
         for lbl in reversed(order):
-            env_lines = _extract_environment(path, lbl, results)
+            info = results[lbl]
+            env_lines = envs[info['file']].get(info.get('label', lbl), [])
             snippet = lean_snippets.get(lbl)
-            env_type = results.get(lbl, {}).get('type')
+            env_type = info.get('type')
 
             if (
                 interleave
@@ -272,22 +522,22 @@ def main():
     parser.add_argument('--tex-out', default='deps.tex', help='TeX output file (with --tex)')
     parser.add_argument('--lean-path', help='Path to mathlib4 for Lean snippets')
     parser.add_argument('--interleave', action='store_true', help='Interleave LaTeX and Lean snippets side-by-side')
+    parser.add_argument('--no-cache', action='store_true', help='Ignore and do not write the on-disk caches')
     args = parser.parse_args()
 
-    results, edges = build_graph(args.path)
-    write_dot(results, edges, args.dot)
+    results, adj = build_graph(args.path, use_cache=not args.no_cache)
+    write_dot(results, adj, args.dot)
     if args.json:
         with open('deps.json', 'w') as j:
-            json.dump({'nodes': results, 'edges': edges}, j, indent=2)
+            json.dump({'nodes': results, 'edges': list(iter_edges(adj))}, j, indent=2)
     lean_snippets = None
     if args.lean_path:
-        tag_map = load_tag_map(args.path)
-        lean_snippets = scan_mathlib(args.lean_path, tag_map)
+        _, lean_snippets = load_lean_snippets(args.path, args.lean_path, use_cache=not args.no_cache)
     if args.tex:
         generate_dependency_tex(
             args.tex,
             results,
-            edges,
+            adj,
             args.path,
             args.tex_out,
             lean_snippets,
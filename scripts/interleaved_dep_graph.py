@@ -53,16 +53,23 @@ MIT licence.  Author: 2025‑06‑12 ChatGPT‑o3.
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import os
+import pickle
 import re
+import shutil
+import subprocess
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
+from functools import cached_property
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Set, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar
 
 import networkx as nx  # type: ignore
-from rich.progress import track  # type: ignore
+from rich.progress import Progress  # type: ignore
 
 # ────────────────────────────────────────────────────────────────────────────
 # CONSTANTS / REGEXES
@@ -80,16 +87,48 @@ ENVIRONMENTS = [
     "situation",
     "equation",
 ]
-BEGIN_ENV_RE = re.compile(r"\\begin{(" + "|".join(ENVIRONMENTS) + r")}")
-LABEL_RE = re.compile(r"\\label{([a-z]+-[0-9A-Za-z-]+)}")
-REF_RE = re.compile(r"\\ref{([a-z]+-[0-9A-Za-z-]+)}")
-TAG_LINE_RE = re.compile(r"^([0-9A-Za-z]{4}),([^,]+)$")
-
-LEAN_ATTR_RE = re.compile(r"@\[\s*stacks\s+([0-9A-Za-z]{4})")
-LEAN_DOC_RE = re.compile(r"Stacks\s+Tag\s+([0-9A-Za-z]{4})", re.IGNORECASE)
-LEAN_HEADER_RE = re.compile(
-    r"^(lemma|theorem|def|definition|structure|class|instance)\s+([\w\.]+)",
+# Opt-in DFA engine for the hot scanning patterns.  google-re2 runs in time
+# linear in the input but differs from `re` in corner cases (e.g. `\s` is
+# ASCII only), so it is used only when STACKS_USE_RE2 is set.
+USE_RE2 = bool(os.environ.get("STACKS_USE_RE2"))
+_re_engine = re
+if USE_RE2:
+    try:
+        import re2 as _re_engine  # type: ignore
+    except ImportError:
+        pass
+
+TEX_TOKEN_RE = re.compile(
+    r"\\begin\{(?P<begin>" + "|".join(ENVIRONMENTS) + r")\}"
+    r"|\\end\{(?P<end>\w+)\}"
+    r"|\\label\{(?P<label>[a-z]+-[0-9A-Za-z-]+)\}"
+    r"|\\ref\{(?P<ref>[a-z]+-[0-9A-Za-z-]+)\}"
 )
+# bytes twin of TEX_TOKEN_RE, run over undecoded file contents
+TEX_TOKEN_RE_B = _re_engine.compile(TEX_TOKEN_RE.pattern.encode("ascii"))
+# TEX_TOKEN_RE group numbers; matches are dispatched on `lastindex` because
+# re2 reports group names of a bytes pattern as bytes
+TEX_BEGIN, TEX_END, TEX_LABEL, TEX_REF = 1, 2, 3, 4
+
+LEAN_ATTR_RE = _re_engine.compile(r"@\[\s*stacks\s+([0-9A-Za-z]{4})")
+LEAN_DOC_RE = _re_engine.compile(r"(?i)Stacks\s+Tag\s+([0-9A-Za-z]{4})")
+# a declaration header starting a (possibly indented) line of a whole file
+LEAN_HEADER_RE = _re_engine.compile(
+    r"(?m)^[^\S\n]*(lemma|theorem|def|definition|structure|class|instance)[^\S\n]+([\w\.]+)",
+)
+LEAN_STACKS_RE = _re_engine.compile(r"(?i)stacks")
+# bytes prefilter for the above: under Unicode case folding "s" and "k" also
+# match U+017F and U+212A, so those UTF-8 sequences count too
+LEAN_HINT_RE = re.compile(rb"(?i)(?:s|\xc5\xbf)tac(?:k|\xe2\x84\xaa)(?:s|\xc5\xbf)")
+LEAN_BLANK_LINE_RE = _re_engine.compile(r"\n[^\S\n]*(?:\n|$)")
+# line breaks other than "\n" that `str.splitlines` honours
+LEAN_LINE_BREAK_RE = re.compile("\r\n|[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+
+# Parsed Lean snippets are cached here between runs, one pickle per checkout
+# holding a fingerprint of its .lean files; bump the version whenever
+# `_parse_lean_file` changes its output.
+LEAN_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "stacks-project"
+LEAN_CACHE_VERSION = 1
 
 # ────────────────────────────────────────────────────────────────────────────
 # DATA CLASSES
@@ -101,17 +140,20 @@ class StacksEnv:
     env_type: str  # lemma / definition / …​
     label: str  # e.g. lemma-weil-additive
     file: Path
-    body: List[str]  # raw lines *inside* the environment
+    body: str  # raw text *inside* the environment
     refs: Set[str]  # other Stacks labels referenced inside body
 
     def short(self) -> str:
         return f"{self.env_type[:3]}:{self.label.split('-', 1)[-1]}"
 
+    @cached_property
     def tex_block(self) -> str:
         """Original LaTeX code of this environment (without surrounding blank lines)."""
         header = f"\\begin{{{self.env_type}}}\\label{{{self.label}}}"
         footer = f"\\end{{{self.env_type}}}"
-        return "\n".join([header, *self.body, footer])
+        if not self.body:
+            return f"{header}\n{footer}"
+        return f"{header}\n{self.body}\n{footer}"
 
 
 @dataclass
@@ -128,12 +170,235 @@ class LeanSnippet:
 # ────────────────────────────────────────────────────────────────────────────
 # PARSERS
 # ────────────────────────────────────────────────────────────────────────────
+# The per-file parsers are free functions returning plain tuples so that they
+# can run in worker processes; the parser classes turn them into objects.
+EnvTuple = Tuple[str, str, Path, str, Set[str]]
+SnippetTuple = Tuple[str, Path, int, List[str]]
+
+
+def _decode_body(raw: bytes) -> str:
+    """Decode a body slice, dropping the newline that ends its last line."""
+    if raw.endswith(b"\n"):
+        raw = raw[:-1]
+    return raw.decode("utf8", errors="ignore")
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _parse_tex_file(path: str) -> List[EnvTuple]:
+    """`(env_type, label, file, body, refs)` for every labelled env in *path*.
+
+    One pass of `TEX_TOKEN_RE_B` over the raw bytes of the file drives a
+    small state machine; only labels, refs and bodies are ever decoded.
+    """
+    envs: List[EnvTuple] = []
+    raw = _read_bytes(path)
+    if b"\\begin{" not in raw:
+        # macros, preamble, chapter glue …​ nothing to extract
+        return envs
+    file = Path(path)
+    env_type: Optional[bytes] = None
+    label: Optional[str] = None
+    refs: Set[str] = set()
+    body_start = 0
+    for m in TEX_TOKEN_RE_B.finditer(raw):
+        kind = m.lastindex
+        if env_type is None:
+            if kind == TEX_BEGIN:
+                env_type = m.group(TEX_BEGIN)
+                label = None
+                refs = set()
+                # the body starts on the line after \begin{…​}
+                newline = raw.find(b"\n", m.end())
+                body_start = len(raw) if newline == -1 else newline + 1
+        elif kind == TEX_END:
+            if m.group(TEX_END) != env_type:
+                continue
+            if label:
+                # the body stops before the line holding \end{…​}
+                body_end = raw.rfind(b"\n", 0, m.start()) + 1
+                if raw[body_end:m.start()].strip():
+                    body_end = m.start()
+                body = _decode_body(raw[body_start:body_end]) if body_end > body_start else ""
+                envs.append((env_type.decode("ascii"), label, file, body, refs))
+            env_type = None
+        elif kind == TEX_LABEL:
+            # the first label is the env's own; later ones belong to equations
+            if label is None:
+                label = m.group(TEX_LABEL).decode("ascii")
+        elif kind == TEX_REF:
+            refs.add(m.group(TEX_REF).decode("ascii"))
+    if env_type is not None and label:
+        # unterminated env at the end of the file
+        envs.append((env_type.decode("ascii"), label, file, _decode_body(raw[body_start:]), refs))
+    return envs
+
+
+def _lean_tag_lines(text: str) -> List[Tuple[int, int, str]]:
+    """`(line_start, line_end, tag)` for every line of *text* that declares a tag.
+
+    Only lines containing "stacks" can match either tag form, so those are
+    found with one scan of the whole text and the tag regexes run on them
+    alone.  A line holds at most one tag; the attribute form wins.
+    """
+    found: List[Tuple[int, int, str]] = []
+    last_start = -1
+    for m in LEAN_STACKS_RE.finditer(text):
+        start = text.rfind("\n", 0, m.start()) + 1
+        if start == last_start:
+            continue
+        last_start = start
+        end = text.find("\n", m.end())
+        if end == -1:
+            end = len(text)
+        line = text[start:end]
+        attr = LEAN_ATTR_RE.search(line)
+        if attr:
+            found.append((start, end, attr.group(1).upper()))
+            continue
+        # detect doc‑string style tags; on the first line the line itself
+        # stands in for the previous one
+        doc = LEAN_DOC_RE.search(line)
+        if not doc:
+            continue
+        prev = text[text.rfind("\n", 0, start - 1) + 1:start - 1] if start else line
+        if prev.lstrip().startswith("/--"):
+            found.append((start, end, doc.group(1).upper()))
+    return found
+
+
+def _parse_lean_file(path: str) -> List[SnippetTuple]:
+    """`(tag, file, start_line, lines)` for every Stacks-tagged declaration in *path*.
+
+    Works on the decoded file as one string: tags and declaration headers are
+    located by offset and only the lines of each snippet are ever split out.
+    """
+    snippets: List[SnippetTuple] = []
+    raw = _read_bytes(path)
+    if not LEAN_HINT_RE.search(raw):
+        # both tag forms mention "stacks" (in any case); most of mathlib never does
+        return snippets
+    text = raw.decode("utf8", errors="ignore")
+    if LEAN_LINE_BREAK_RE.search(text):
+        # make "\n" the only line separator, as `str.splitlines` sees it
+        text = LEAN_LINE_BREAK_RE.sub("\n", text)
+    tags = _lean_tag_lines(text)
+    file = Path(path)
+    pending_tags: List[str] = []
+    pos = 0
+    k = 0
+    line_no, counted = 1, 0
+    while True:
+        # tag lines swallowed by a snippet do not count
+        while k < len(tags) and tags[k][0] < pos:
+            k += 1
+        head = LEAN_HEADER_RE.search(text, pos) if pending_tags else None
+        if k < len(tags) and (head is None or tags[k][0] <= head.start()):
+            pending_tags.append(tags[k][2])
+            pos = tags[k][1] + 1
+            continue
+        if head is None:
+            break
+        # capture until the first blank line
+        start = head.start()
+        blank = LEAN_BLANK_LINE_RE.search(text, start)
+        end = blank.start() if blank else len(text)
+        line_no += text.count("\n", counted, start)
+        counted = start
+        snippet_lines = text[start:end].split("\n")
+        # attach snippet to *all* pending tags (can be more than one)
+        for tag in pending_tags:
+            snippets.append((tag, file, line_no, snippet_lines))
+        pending_tags = []
+        pos = end + 1
+    return snippets
+
+
+def _iter_lean_files(root: Path) -> Iterator[str]:
+    """Paths (as `str`) of all .lean files below *root*, in `rglob` order.
+
+    Walks with `os.scandir` so that no `Path` is built per visited entry and
+    `DirEntry.is_dir` answers from the directory listing without a `stat`.
+    """
+    stack = [os.fspath(root)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        subdirs: List[str] = []
+        with entries:
+            for e in entries:
+                if e.is_dir(follow_symlinks=False):
+                    subdirs.append(e.path)
+                elif e.name.endswith(".lean"):
+                    yield e.path
+        # depth first, siblings in listing order
+        stack.extend(reversed(subdirs))
+
+
+def _rg_skippable(root: Path) -> Optional[Set[str]]:
+    """Files under *root* that ripgrep confirms never match `LEAN_HINT_RE`.
+
+    Same test as the early-out in `_parse_lean_file`, but run by ripgrep's
+    SIMD-accelerated search across the whole tree at once.  Only files ripgrep
+    actually read and rejected are listed, so anything its walk leaves out
+    (symlinks, for one) is still parsed.  Returns `None` when `rg` is not
+    installed or fails, in which case every file is parsed.
+    """
+    rg = shutil.which("rg")
+    if rg is None:
+        return None
+    cmd = [
+        rg, "--no-config", "--files-without-match", "--no-ignore", "--hidden", "--no-messages",
+        # raw bytes, as `_parse_lean_file` sees them: no BOM sniffing, no
+        # giving up on files that look binary
+        "--text", "--encoding", "none",
+        "--ignore-case", "--glob", "*.lean", "-e", "(?:s|\u017f)tac(?:k|\u212a)(?:s|\u017f)", os.fspath(root),
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, check=False)
+    except OSError:
+        return None
+    if proc.returncode not in (0, 1):
+        return None
+    return set(os.fsdecode(proc.stdout).splitlines())
+
+
+T = TypeVar("T")
+
+
+def _progress(items: Iterable[T], total: int, description: str, batch: int = 32) -> Iterator[T]:
+    """Like `rich.progress.track`, but the bar is advanced once per *batch* items.
+
+    Most files parse in well under a millisecond, so redrawing per item would
+    dominate the loop.  No bar is shown when stdout is not a terminal.
+    """
+    with Progress(disable=not sys.stdout.isatty()) as progress:
+        task = progress.add_task(description, total=total)
+        done = 0
+        for item in items:
+            yield item
+            done += 1
+            if done == batch:
+                progress.advance(task, done)
+                done = 0
+        progress.advance(task, done)
+
+
 class StacksParser:
     """Parse a Stacks Project checkout and extract every labelled env."""
 
     def __init__(self, root: Path):
         self.root = root
         self.tag_map = self._load_tag_map()
+        # reverse index label → tag; the first tag listed for a label wins
+        self.label_to_tag: Dict[str, str] = {}
+        for tag, label in self.tag_map.items():
+            self.label_to_tag.setdefault(label, tag)
         self.envs: Dict[str, StacksEnv] = {}
 
     # ‑‑‑ PRIVATE helpers ‑‑‑
@@ -144,51 +409,36 @@ class StacksParser:
             return mapping
         for raw in tags_file.read_text(encoding="utf8").splitlines():
             raw = raw.strip()
-            if not raw or raw.startswith("#"):
+            if not raw or raw[0] == "#":
+                continue
+            # TAG,LABEL with a four character alphanumeric tag
+            tag, sep, label = raw.partition(",")
+            if not sep or not label or "," in label:
                 continue
-            m = TAG_LINE_RE.match(raw)
-            if m:
-                tag, label = m.groups()
-                mapping[tag.upper()] = label  # tag → TeX label (lemma‑foo)
+            if len(tag) != 4 or not (tag.isascii() and tag.isalnum()):
+                continue
+            # tag → TeX label (lemma‑foo); interned as they recur everywhere
+            mapping[sys.intern(tag.upper())] = sys.intern(label)
         return mapping
 
     # ‑‑‑ PUBLIC API ‑‑‑
     def parse(self) -> None:
-        """Populate `self.envs`. Takes <1 s for a full Stacks checkout."""
-        tex_files = [p for p in self.root.glob("*.tex") if p.name != "chapters.tex"]
-        for path in track(tex_files, description="Parsing Stacks .tex"):
-            self._parse_tex_file(path)
-
-    # ‑‑‑ INTERNAL .tex parser ‑‑‑
-    def _parse_tex_file(self, path: Path):
-        lines = path.read_text(encoding="utf8", errors="ignore").splitlines()
-        i = 0
-        while i < len(lines):
-            match = BEGIN_ENV_RE.match(lines[i].strip())
-            if not match:
-                i += 1
-                continue
-            env_type = match.group(1)
-            # collect until \end{…​}
-            body: List[str] = []
-            label: Optional[str] = None
-            i += 1
-            while i < len(lines):
-                line = lines[i]
-                if line.strip().startswith(f"\\end{{{env_type}}}"):
-                    break
-                mlabel = LABEL_RE.search(line)
-                if mlabel:
-                    label = mlabel.group(1)
-                body.append(line)
-                i += 1
-            # skip the closing \end line as well
-            i += 1
-            if not label:
-                # Unlabelled env.  Ignore.
-                continue
-            refs = set(REF_RE.findall("\n".join(body)))
-            self.envs[label] = StacksEnv(env_type, label, path, body, refs)
+        """Populate `self.envs`, parsing the .tex files in parallel."""
+        with os.scandir(self.root) as entries:
+            tex_files = [
+                e.path
+                for e in entries
+                if e.name.endswith(".tex") and e.name != "chapters.tex" and e.is_file()
+            ]
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+            results = ex.map(_parse_tex_file, tex_files, chunksize=8)
+            for envs in _progress(results, len(tex_files), "Parsing Stacks .tex"):
+                # strings interned in a worker arrive as fresh copies, so the
+                # labels and refs are interned here, where they are kept
+                for env_type, label, file, body, refs in envs:
+                    label = sys.intern(label)
+                    refs = {sys.intern(ref) for ref in refs}
+                    self.envs[label] = StacksEnv(sys.intern(env_type), label, file, body, refs)
 
 
 class LeanParser:
@@ -198,44 +448,78 @@ class LeanParser:
         self.root = root
         self.snippets: Dict[str, LeanSnippet] = {}  # tag → snippet
 
-    def parse(self) -> None:
-        lean_files = list(self.root.rglob("*.lean"))
-        for path in track(lean_files, description="Parsing Lean files"):
-            self._parse_lean_file(path)
-
-    # ‑‑‑ internal helpers ‑‑‑
-    def _parse_lean_file(self, path: Path):
-        lines = path.read_text(encoding="utf8", errors="ignore").splitlines()
-        pending_tags: List[str] = []
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            attr = LEAN_ATTR_RE.search(line)
-            if attr:
-                pending_tags.append(attr.group(1).upper())
-                i += 1
-                continue
-            # detect doc‑string style tags
-            doc = LEAN_DOC_RE.search(line)
-            if doc and lines[max(i-1, 0)].lstrip().startswith("/--"):
-                pending_tags.append(doc.group(1).upper())
-                i += 1
-                continue
-            head = LEAN_HEADER_RE.match(line.strip())
-            if head and pending_tags:
-                # capture until blank line or next declaration
-                start = i
-                snippet_lines = [line]
-                i += 1
-                while i < len(lines) and lines[i].strip():
-                    snippet_lines.append(lines[i])
-                    i += 1
-                # attach snippet to *all* pending tags (can be more than one)
-                for tag in pending_tags:
-                    self.snippets[tag] = LeanSnippet(tag, path, start + 1, snippet_lines)
-                pending_tags = []
+    def parse(self, use_cache: bool = True) -> None:
+        """Populate `self.snippets`.
+
+        Unless *use_cache* is false, the result is reused from (and saved to)
+        `LEAN_CACHE_DIR` as long as no .lean file is added, removed or touched.
+        """
+        lean_files = list(_iter_lean_files(self.root))
+        if use_cache:
+            cache_file = self._cache_file()
+            key = self._cache_key(lean_files)
+            cached = self._load_cache(cache_file, key)
+            if cached is not None:
+                self.snippets = cached
+                return
+        skippable = _rg_skippable(self.root)
+        if skippable:
+            lean_files = [p for p in lean_files if p not in skippable]
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+            results = ex.map(_parse_lean_file, lean_files, chunksize=8)
+            for snippets in _progress(results, len(lean_files), "Parsing Lean files"):
+                for tag, file, start_line, lines in snippets:
+                    tag = sys.intern(tag)
+                    self.snippets[tag] = LeanSnippet(tag, file, start_line, lines)
+        if use_cache:
+            self._store_cache(cache_file, key)
+
+    # ‑‑‑ PRIVATE helpers ‑‑‑
+    def _cache_file(self) -> Path:
+        # one file per checkout, overwritten whenever the checkout changes
+        root = str(self.root.resolve())
+        digest = hashlib.sha1(root.encode("utf8")).hexdigest()[:16]
+        return LEAN_CACHE_DIR / f"lean_snippets_{digest}.pickle"
+
+    def _cache_key(self, lean_files: List[str]) -> Tuple[object, ...]:
+        # newest mtime plus file count notices edits, additions and deletions
+        newest = 0
+        count = 0
+        for path in lean_files:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                # removed since the walk
                 continue
-            i += 1
+            count += 1
+            newest = max(newest, mtime)
+        return (LEAN_CACHE_VERSION, str(self.root.resolve()), newest, count)
+
+    @staticmethod
+    def _load_cache(cache_file: Path, key: Tuple[object, ...]) -> Optional[Dict[str, LeanSnippet]]:
+        try:
+            with cache_file.open("rb") as f:
+                cached_key, snippets = pickle.load(f)
+        except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return None
+        return snippets if cached_key == key else None
+
+    def _store_cache(self, cache_file: Path, key: Tuple[object, ...]) -> None:
+        # write atomically; a cache that cannot be written is simply skipped
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=cache_file.parent)
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((key, self.snippets), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache_file)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
 
 
 # ────────────────────────────────────────────────────────────────────────────
@@ -264,38 +548,54 @@ class DependencyGraphBuilder:
         if root_label not in self.stacks.envs:
             raise KeyError(f"Unknown label {root_label!r} in Stacks data")
 
-        def _should_stop(label: str, d: int):
-            if depth is not None and d >= depth:
-                return True
-            if not self.include_defs:
-                return False
-            env = self.stacks.envs[label]
-            return env.env_type == "definition"
-
+        # iterative DFS: dependency chains can exceed the recursion limit.
+        # The loop is written out twice so that the common unbounded walk
+        # carries no depth bookkeeping.
+        envs = self.stacks.envs
+        add_node, add_edge = self._add_node, self._add_edge
+        stop_types = {"definition"} if self.include_defs else set()
         visited: Set[str] = set()
-
-        def dfs(label: str, d: int = 0):
-            if label in visited:
-                return
-            visited.add(label)
-            env = self.stacks.envs[label]
-            self._add_node(env)
-            if _should_stop(label, d):
-                return
-            for dep in env.refs:
-                if dep not in self.stacks.envs:
-                    # dangling reference (rare)
+        if depth is None:
+            stack: List[str] = [root_label]
+            while stack:
+                label = stack.pop()
+                if label in visited:
                     continue
-                self._add_edge(label, dep)
-                dfs(dep, d + 1)
-
-        dfs(root_label)
+                visited.add(label)
+                env = envs[label]
+                add_node(env)
+                if env.env_type in stop_types:
+                    continue
+                for dep in env.refs:
+                    if dep not in envs:
+                        # dangling reference (rare)
+                        continue
+                    add_edge(label, dep)
+                    stack.append(dep)
+        else:
+            depth_stack: List[Tuple[str, int]] = [(root_label, 0)]
+            while depth_stack:
+                label, d = depth_stack.pop()
+                if label in visited:
+                    continue
+                visited.add(label)
+                env = envs[label]
+                add_node(env)
+                if d >= depth or env.env_type in stop_types:
+                    continue
+                for dep in env.refs:
+                    if dep not in envs:
+                        # dangling reference (rare)
+                        continue
+                    add_edge(label, dep)
+                    depth_stack.append((dep, d + 1))
 
     # ‑‑‑ helpers ‑‑‑
     def _add_node(self, env: StacksEnv):
+        # the TeX block is assembled lazily by the exporters from `env`
         data = {
             "type": env.env_type,
-            "tex": env.tex_block(),
+            "env": env,
         }
         # attach Lean snippet if any
         tag = self._label_to_tag(env.label)
@@ -307,11 +607,7 @@ class DependencyGraphBuilder:
         self.G.add_edge(src, tgt)
 
     def _label_to_tag(self, label: str) -> Optional[str]:
-        # In the Stacks repo, the tag map is bidirectional: tag → label.
-        for tag, lab in self.stacks.tag_map.items():
-            if lab == label:
-                return tag
-        return None
+        return self.stacks.label_to_tag.get(label)
 
 
 # ────────────────────────────────────────────────────────────────────────────
@@ -323,17 +619,45 @@ class Exporter:
     def __init__(self, G: nx.DiGraph):
         self.G = G
 
+    # graph traversals shared by the TeX helpers, computed at most once
+    @cached_property
+    def _topo(self) -> List[str]:
+        return list(nx.topological_sort(self.G))
+
+    @cached_property
+    def _in_degree(self) -> Dict[str, int]:
+        return dict(self.G.in_degree())
+
     def to_dot(self, outfile: Path):
-        try:
-            import pydot  # type: ignore
-        except ImportError as e:
-            raise SystemExit("pydot not installed; `pip install pydot`." ) from e
-        graph = nx.drawing.nx_pydot.to_pydot(self.G)
-        outfile.write_text(graph.to_string())
+        # Stacks labels are plain `[a-z]+-[0-9A-Za-z-]+` identifiers, so the
+        # DOT is written by hand instead of going through pydot.
+        with outfile.open("w", encoding="utf8") as f:
+            f.write("strict digraph {\n")
+            for label, data in self.G.nodes(data=True):
+                env_type = data.get("type")
+                if env_type:
+                    f.write(f'"{label}" [type="{env_type}"];\n')
+                else:
+                    f.write(f'"{label}";\n')
+            for src, tgt in self.G.edges:
+                f.write(f'"{src}" -> "{tgt}";\n')
+            f.write("}\n")
 
     def to_json(self, outfile: Path):
         data = nx.node_link_data(self.G)
-        outfile.write_text(json.dumps(data, indent=2))
+        # node_link_data copies the attribute dicts, so swap in the TeX here
+        for node in data["nodes"]:
+            env = node.pop("env", None)
+            if env is not None:
+                node["tex"] = env.tex_block
+        try:
+            import orjson  # type: ignore
+        except ImportError:
+            # stream into the file rather than building the whole text first
+            with outfile.open("w", encoding="utf8") as f:
+                json.dump(data, f, indent=2)
+        else:
+            outfile.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
     # ‑‑‑ TeX export ‑‑‑
     def to_tex(self, outfile: Path, interleave: bool = False):
@@ -364,10 +688,11 @@ class Exporter:
         # a simple top‑down layered layout using TikZ‑cd
         lines = [r"\begin{tikzcd}[column sep=huge, row sep=huge]"]
         # group nodes by depth from roots (sources with no incoming edges)
-        roots = [n for n in self.G.nodes if self.G.in_degree(n) == 0]
+        roots = [n for n in self.G.nodes if self._in_degree[n] == 0]
         if not roots:
             roots = list(self.G.nodes)
-        depth_map = nx.single_source_shortest_path_length(self.G.reverse(copy=False), roots[0])
+        # edges point statement → dependency, so a forward BFS gives the rows
+        depth_map = nx.single_source_shortest_path_length(self.G, roots[0])
         # bucket by depth
         buckets: Dict[int, List[str]] = {}
         for node, d in depth_map.items():
@@ -384,12 +709,12 @@ class Exporter:
     # helper: interleaved minipage blocks
     def _interleave_blocks(self) -> List[str]:
         out: List[str] = []
-        for label in nx.topological_sort(self.G):
+        for label in self._topo:
             node = self.G.nodes[label]
             out.extend(
                 [
                     r"\begin{minipage}[t]{0.48\linewidth}",
-                    node["tex"],
+                    node["env"].tex_block,
                     rf"\end{{minipage}}\hfill\begin{{minipage}}[t]{{0.48\linewidth}}",
                     r"\begin{lstlisting}",
                     node.get("lean", "% no Lean snippet"),
@@ -403,11 +728,11 @@ class Exporter:
     # helper: appendix style (LaTeX first, Lean later)
     def _appendix_blocks(self) -> List[str]:
         out: List[str] = [r"\section*{Stacks statements}"]
-        for label in nx.topological_sort(self.G):
-            out.append(self.G.nodes[label]["tex"])
+        for label in self._topo:
+            out.append(self.G.nodes[label]["env"].tex_block)
             out.append(r"\bigskip")
         out.append(r"\newpage\section*{Lean snippets}")
-        for label in nx.topological_sort(self.G):
+        for label in self._topo:
             snippet = self.G.nodes[label].get("lean")
             if not snippet:
                 continue
@@ -430,6 +755,7 @@ def main():
     p.add_argument("--depth", type=int, help="Maximum DFS depth (0 = just the node itself)")
     p.add_argument("--no-defs", action="store_true", help="Do *not* automatically stop at definitions")
     p.add_argument("--interleave", action="store_true", help="Place Lean snippets next to each LaTeX env")
+    p.add_argument("--no-cache", action="store_true", help="Re-scan mathlib4 instead of using the Lean snippet cache")
 
     args = p.parse_args()
 
@@ -439,7 +765,7 @@ def main():
     lean_parser = None
     if args.lean_root:
         lean_parser = LeanParser(args.lean_root)
-        lean_parser.parse()
+        lean_parser.parse(use_cache=not args.no_cache)
 
     if not args.tex:
         p.error("--tex LABEL is required (future versions may add more modes)")
@@ -25,7 +25,7 @@ class ComputeStatsTests(unittest.TestCase):
             os.makedirs(ml)
             with open(os.path.join(ml, 'test.lean'), 'w') as f:
                 f.write('@[stacks ABCD]\nlemma foo : True := by trivial\n')
-            stats = compute_stats(d, ml)
+            stats = compute_stats(d, ml, use_cache=False)
             self.assertEqual(stats['num_lean_snippets'], 1)
             self.assertEqual(stats['num_nodes_with_lean_snippet'], 1)
 
@@ -45,7 +45,7 @@ class ComputeStatsTests(unittest.TestCase):
             os.makedirs(ml)
             with open(os.path.join(ml, 'ref.lean'), 'w') as f:
                 f.write('@[stacks ABCD]\nlemma foo : True := by trivial\n')
-            stats = compute_stats(d, ml)
+            stats = compute_stats(d, ml, use_cache=False)
             self.assertEqual(stats['num_nodes'], 2)
             self.assertEqual(stats['num_lean_snippets'], 1)
             self.assertEqual(stats['num_nodes_with_lean_snippet'], 1)
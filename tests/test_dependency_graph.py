@@ -2,10 +2,19 @@ import os
 import sys
 import tempfile
 import unittest
+from unittest import mock
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from scripts.dependency_graph import load_tag_map, scan_mathlib, generate_dependency_tex
+from scripts import dependency_graph
+from scripts.dependency_graph import (
+    GRAPH_CACHE,
+    build_graph,
+    load_lean_snippets,
+    load_tag_map,
+    scan_mathlib,
+    generate_dependency_tex,
+)
 
 class DependencyGraphTests(unittest.TestCase):
     def test_load_tag_map(self):
@@ -17,6 +26,24 @@ class DependencyGraphTests(unittest.TestCase):
             self.assertEqual(mp['0001'], 'label-foo')
             self.assertEqual(mp['0002'], 'label-bar')
 
+    def test_build_graph_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, 'Makefile'), 'w') as f:
+                f.write('LIJST = sample\n')
+            sample = os.path.join(d, 'sample.tex')
+            with open(sample, 'w') as f:
+                f.write('\\begin{lemma}\n\\label{lemma-a}\nA\n\\end{lemma}\n')
+            results, _ = build_graph(d)
+            self.assertIn('sample-lemma-a', results)
+            self.assertTrue(os.path.exists(os.path.join(d, GRAPH_CACHE)))
+            self.assertEqual(build_graph(d), build_graph(d, use_cache=False))
+            with open(sample, 'w') as f:
+                f.write('\\begin{lemma}\n\\label{lemma-b}\nB\n\\end{lemma}\n')
+            st = os.stat(sample)
+            os.utime(sample, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            results, _ = build_graph(d)
+            self.assertEqual(list(results), ['sample-lemma-b'])
+
     def test_scan_mathlib(self):
         with tempfile.TemporaryDirectory() as d:
             tag_map = {'0001': 'label-foo'}
@@ -34,6 +61,47 @@ class DependencyGraphTests(unittest.TestCase):
             snippet = res['label-foo']
             self.assertRegex(snippet, r'(lemma|def) (foo|bar|baz)')
 
+    def test_scan_mathlib_unicode_name(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, 'zeta.lean'), 'w', encoding='utf-8') as f:
+                f.write('/-- Stacks Tag 0001 -/\ntheorem ζ_spec : True := by\n  trivial\n')
+            res = scan_mathlib(d, {'0001': 'lab-a'})
+            self.assertEqual(res, {'lab-a': 'theorem ζ_spec : True := by\n  trivial\n'})
+
+    def test_scan_mathlib_url_wins_on_a_line(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, 'both.lean'), 'w') as f:
+                f.write('lemma foo : True := by\n')
+                f.write('  -- see Stacks Tag 0002, https://stacks.math.columbia.edu/tag/0001\n')
+                f.write('  trivial\n')
+            res = scan_mathlib(d, {'0001': 'lab-a', '0002': 'lab-b'})
+            self.assertEqual(list(res), ['lab-a'])
+
+    def test_load_lean_snippets_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            os.makedirs(os.path.join(d, 'tags'))
+            with open(os.path.join(d, 'tags', 'tags'), 'w') as f:
+                f.write('0001,lab-a\n0002,lab-b\n')
+            ml = os.path.join(d, 'ml')
+            os.makedirs(os.path.join(ml, 'Mathlib'))
+            lean = os.path.join(ml, 'Mathlib', 'A.lean')
+            with open(lean, 'w') as f:
+                f.write('@[stacks 0001]\nlemma a : True := trivial\n')
+            cache = os.path.join(d, 'cache', 'stacks-lean.pkl')
+            with mock.patch.object(dependency_graph, 'LEAN_CACHE', cache):
+                _, first = load_lean_snippets(d, ml)
+                self.assertEqual(list(first), ['lab-a'])
+                self.assertTrue(os.path.exists(cache))
+                with mock.patch.object(dependency_graph, 'scan_mathlib') as scan:
+                    self.assertEqual(load_lean_snippets(d, ml)[1], first)
+                    scan.assert_not_called()
+                with open(lean, 'a') as f:
+                    f.write('\n@[stacks 0002]\nlemma b : True := trivial\n')
+                st = os.stat(lean)
+                os.utime(lean, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+                _, updated = load_lean_snippets(d, ml)
+                self.assertEqual(sorted(updated), ['lab-a', 'lab-b'])
+
     def test_generate_dependency_tex(self):
         with tempfile.TemporaryDirectory() as d:
             sample = os.path.join(d, 'sample.tex')
@@ -44,10 +112,10 @@ class DependencyGraphTests(unittest.TestCase):
                 'sample-lemma-a': {'type': 'lemma', 'file': 'sample', 'label': 'lemma-a'},
                 'sample-lemma-b': {'type': 'lemma', 'file': 'sample', 'label': 'lemma-b'},
             }
-            edges = [('sample-lemma-b', 'sample-lemma-a')]
+            adj = {'sample-lemma-b': ['sample-lemma-a']}
             snips = {'sample-lemma-a': 'lemma lemma_a : True := by trivial'}
             out = os.path.join(d, 'out.tex')
-            generate_dependency_tex('sample-lemma-b', results, edges, d, out, snips)
+            generate_dependency_tex('sample-lemma-b', results, adj, d, out, snips)
             with open(out) as f:
                 data = f.read()
         self.assertIn('lemma lemma_a', data)
@@ -64,13 +132,13 @@ class DependencyGraphTests(unittest.TestCase):
                     'label': 'lemma-a',
                 }
             }
-            edges = []
+            adj = {}
             snips = {'sample-lemma-a': 'lemma lemma_a : True := by trivial'}
             out = os.path.join(d, 'out.tex')
             generate_dependency_tex(
                 'sample-lemma-a',
                 results,
-                edges,
+                adj,
                 d,
                 out,
                 snips,
@@ -23,7 +23,7 @@ class InterleaveExampleTest(unittest.TestCase):
                     'label': 'lemma-a',
                 }
             }
-            edges = []
+            adj = {}
             snippet = (
                 'lemma lemma_a (n : Nat) :\\n'
                 '  (Finset.range (n + 1)).sum id = n * (n + 1) / 2 := by\\n'
@@ -31,11 +31,12 @@ class InterleaveExampleTest(unittest.TestCase):
             )
             snips = {'sample-lemma-a': snippet}
             out = os.path.join(d, 'out.tex')
-            generate_dependency_tex('sample-lemma-a', results, edges, d, out, snips, interleave=True)
+            generate_dependency_tex('sample-lemma-a', results, adj, d, out, snips, interleave=True)
             with open(out) as f:
                 data = f.read()
             self.assertIn('Finset.range', data)
             self.assertIn('minipage', data)
+            self.assertIn('\\sum_{i=0}^n i', data)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,14 @@
 import os
 import sys
 import json
+import re
 from pathlib import Path
 
+import pytest
+
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
+import scripts.interleaved_dep_graph as idg
 from scripts.interleaved_dep_graph import (
     StacksParser,
     LeanParser,
@@ -51,7 +55,7 @@ def test_parsers_and_graph(tmp_path: Path):
     assert sp.envs['lemma-a'].refs == {'lemma-b'}
 
     lp = LeanParser(ml_root)
-    lp.parse()
+    lp.parse(use_cache=False)
     assert 'ABCD' in lp.snippets
 
     builder = DependencyGraphBuilder(sp, lp)
@@ -65,3 +69,96 @@ def test_parsers_and_graph(tmp_path: Path):
     Exporter(G).to_json(out_json)
     data = json.loads(out_json.read_text())
     assert any(n['id'] == 'lemma-a' for n in data['nodes'])
+
+    out_tex = tmp_path / 'graph.tex'
+    Exporter(G).to_tex(out_tex)
+    tikz = out_tex.read_text().split('\\begin{tikzcd}')[1].split('\\end{tikzcd}')[0]
+    rows = [row for row in tikz.splitlines()[1:] if row]
+    assert rows == ['lem:a \\\\', 'lem:b \\\\']
+
+
+def test_lean_parser_cache(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(idg, 'LEAN_CACHE_DIR', tmp_path / 'cache')
+    ml_root = make_mathlib(tmp_path)
+
+    fresh = LeanParser(ml_root)
+    fresh.parse()
+    assert len(list((tmp_path / 'cache').iterdir())) == 1
+
+    cached = LeanParser(ml_root)
+    cached.parse()
+    assert cached.snippets == fresh.snippets
+
+    (ml_root / 'more.lean').write_text('@[stacks EFGH]\ntheorem bar : True := trivial\n')
+    updated = LeanParser(ml_root)
+    updated.parse()
+    assert set(updated.snippets) == {'ABCD', 'EFGH'}
+    # the pickle for this checkout is replaced, not joined by another one
+    assert len(list((tmp_path / 'cache').iterdir())) == 1
+
+    # a file removed between the walk and the fingerprint is just skipped
+    gone = str(ml_root / 'gone.lean')
+    assert updated._cache_key([gone]) == updated._cache_key([])
+
+
+def test_parse_lean_file_unicode_case_folded_tag(tmp_path: Path):
+    # "ſ" (U+017F) folds to "s", so LEAN_DOC_RE accepts this docstring tag
+    lean = tmp_path / 'fold.lean'
+    lean.write_text('/--\nſtacks Tag 0006 -/\ndef foo : Nat := 1\n', encoding='utf8')
+    snippets = idg._parse_lean_file(str(lean))
+    assert [(tag, lines) for tag, _, _, lines in snippets] == [('0006', ['def foo : Nat := 1'])]
+
+
+RG_STUB = """#!{python}
+# Stand-in for `rg --files-without-match`: like ripgrep it does not follow
+# symlinks while walking.
+import os, re, sys
+root = sys.argv[-1]
+for dirpath, dirnames, filenames in os.walk(root):
+    dirnames.sort()
+    for name in sorted(filenames):
+        path = os.path.join(dirpath, name)
+        if not name.endswith('.lean') or os.path.islink(path):
+            continue
+        with open(path, 'rb') as f:
+            if not re.search(rb'(?i)(?:s|\\xc5\\xbf)tac(?:k|\\xe2\\x84\\xaa)(?:s|\\xc5\\xbf)', f.read()):
+                print(path)
+"""
+
+
+def test_rg_prefilter_keeps_unsearched_files(tmp_path: Path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    rg = bin_dir / 'rg'
+    rg.write_text(RG_STUB.format(python=sys.executable))
+    rg.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ.get('PATH', ''))
+
+    ml_root = make_mathlib(tmp_path)
+    (ml_root / 'plain.lean').write_text('lemma bar : True := trivial\n')
+    outside = tmp_path / 'outside.lean'
+    outside.write_text('@[stacks EFGH]\ntheorem baz : True := trivial\n')
+    (ml_root / 'link.lean').symlink_to(outside)
+
+    skippable = idg._rg_skippable(ml_root)
+    assert skippable == {str(ml_root / 'plain.lean')}
+    kept = [p for p in idg._iter_lean_files(ml_root) if p not in skippable]
+    assert sorted(kept) == [str(ml_root / 'link.lean'), str(ml_root / 'test.lean')]
+
+    lp = LeanParser(ml_root)
+    lp.parse(use_cache=False)
+    assert set(lp.snippets) == {'ABCD', 'EFGH'}
+
+
+def test_parse_tex_file_re2_matches_re(tmp_path: Path, monkeypatch):
+    re2 = pytest.importorskip('re2')
+    sample = str(make_stacks(tmp_path) / 'sample.tex')
+    pattern = idg.TEX_TOKEN_RE.pattern.encode('ascii')
+
+    monkeypatch.setattr(idg, 'TEX_TOKEN_RE_B', re.compile(pattern))
+    with_re = idg._parse_tex_file(sample)
+    monkeypatch.setattr(idg, 'TEX_TOKEN_RE_B', re2.compile(pattern))
+    with_re2 = idg._parse_tex_file(sample)
+
+    assert [env[1] for env in with_re] == ['lemma-a', 'lemma-b']
+    assert with_re2 == with_re